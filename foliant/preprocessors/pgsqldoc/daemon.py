@@ -0,0 +1,417 @@
+'''
+Catalog daemon for pgsqldoc.
+
+A long-running process started with the pgsqldoc-daemon command. It keeps
+connections to the databases and the collected datasets in memory and
+serves them to the preprocessor over a local Unix socket, so a rebuild
+costs only a render. An event trigger installed in the database (with
+pgsqldoc-daemon install-trigger) sends a notification on every DDL command
+(including COMMENT ON), and only the datasets affected by the change are
+fetched again.
+'''
+
+import argparse
+import getpass
+import json
+import logging
+import os
+import psycopg2
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import traceback
+
+from .drivers import Psycopg2Driver
+from .queries import DATASETS
+from logging import getLogger
+
+CHANNEL = 'pgsqldoc_ddl'
+TRIGGER_NAME = 'pgsqldoc_ddl'
+FUNCTION_NAME = 'public.pgsqldoc_notify_ddl'
+
+# seconds to wait for the daemon answer; first collection may take a while
+CLIENT_TIMEOUT = 300
+
+INSTALL_SQL = f'''CREATE OR REPLACE FUNCTION {FUNCTION_NAME}()
+RETURNS event_trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    obj record;
+    object_types text := '';
+BEGIN
+    FOR obj IN SELECT DISTINCT object_type
+               FROM pg_event_trigger_ddl_commands() LOOP
+        object_types := object_types || ',' || obj.object_type;
+    END LOOP;
+    -- pg_notify rejects payloads of 8000 bytes and longer
+    PERFORM pg_notify('{CHANNEL}',
+                      left(tg_tag || '|' || object_types, 7999));
+END;
+$$;
+CREATE EVENT TRIGGER {TRIGGER_NAME} ON ddl_command_end
+EXECUTE PROCEDURE {FUNCTION_NAME}();'''
+
+UNINSTALL_SQL = f'''DROP EVENT TRIGGER IF EXISTS {TRIGGER_NAME};
+DROP FUNCTION IF EXISTS {FUNCTION_NAME}();'''
+
+# keywords of command tags and object types and datasets they affect
+AFFECTED_DATASETS = (
+    ('SCHEMA', DATASETS),
+    ('TABLE', ('tables', 'triggers')),
+    ('VIEW', ('tables',)),
+    ('COLUMN', ('tables',)),
+    ('CONSTRAINT', ('tables',)),
+    ('FUNCTION', ('functions', 'triggers')),
+    ('PROCEDURE', ('functions',)),
+    ('TRIGGER', ('triggers',)),
+)
+
+# COMMENT ON changes only descriptions, which are shown for these objects
+COMMENTED_DATASETS = (
+    ('TABLE', ('tables',)),
+    ('VIEW', ('tables',)),
+    ('COLUMN', ('tables',)),
+    ('FUNCTION', ('functions',)),
+    ('PROCEDURE', ('functions',)),
+)
+
+
+def get_affected_datasets(payload: str) -> set:
+    '''
+    Parse notification payload sent by the event trigger and return set of
+    datasets which should be refreshed.
+
+    payload (str) — string in format '<command tag>|,<object type>,...',
+                    e.g. 'COMMENT|,table column'.
+
+    If payload of a command other than COMMENT ON doesn't match any known
+    keyword, all datasets are considered affected.
+    '''
+
+    payload = payload.upper()
+    tag = payload.partition('|')[0]
+    if tag == 'COMMENT':
+        keywords, default = COMMENTED_DATASETS, set()
+    else:
+        keywords, default = AFFECTED_DATASETS, set(DATASETS)
+
+    result = set()
+    for keyword, datasets in keywords:
+        if keyword in payload:
+            result.update(datasets)
+    return result or default
+
+
+class CatalogDaemon:
+    '''
+    Keeps connection to the database and datasets collected for each set of
+    filters. Datasets are refreshed only after notifications about DDL
+    changes. If the event trigger is not installed in the database, the
+    connection is still reused but datasets are collected anew on each
+    request.
+
+    dsn (str) — connection string;
+    collector (callable) — function which takes driver, filters and
+                           tuple of datasets to collect and returns dict
+                           with collected datasets.
+    '''
+
+    def __init__(self,
+                 dsn: str,
+                 collector,
+                 logger=None):
+        self._dsn = dsn
+        self._collector = collector
+        self.logger = logger or getLogger('pgsqldoc.daemon')
+        self._con = None
+        self.listening = False
+        # filters key -> collected datasets
+        self._cache = {}
+        # filters key -> set of datasets to refresh
+        self._stale = {}
+
+    def start(self):
+        '''
+        Connect to the database and start listening to the notifications if
+        the event trigger is installed. Cache is cleared.
+        '''
+
+        self.stop()
+        self.logger.debug('Starting catalog daemon')
+        self._con = psycopg2.connect(self._dsn)
+        # don't keep transactions open between builds
+        self._con.autocommit = True
+        self.listening = self._check_trigger()
+        if self.listening:
+            try:
+                with self._con.cursor() as cur:
+                    cur.execute(f'LISTEN {CHANNEL}')
+                self.logger.debug(f'Listening to channel {CHANNEL}')
+            except psycopg2.Error:
+                # e.g. connected to a standby server
+                info = traceback.format_exc()
+                self.logger.debug(f'Failed to listen to channel {CHANNEL}, '
+                                  f'datasets will not be cached:\n\n{info}')
+                self.listening = False
+
+    def stop(self):
+        '''Close connection and clear cache.'''
+
+        self._cache = {}
+        self._stale = {}
+        self.listening = False
+        if self._con is not None and not self._con.closed:
+            self._con.close()
+        self._con = None
+
+    def _check_trigger(self) -> bool:
+        '''Return True if event trigger is installed in the database.'''
+
+        with self._con.cursor() as cur:
+            cur.execute('SELECT 1 FROM pg_catalog.pg_event_trigger '
+                        'WHERE evtname = %s', (TRIGGER_NAME,))
+            if cur.fetchone():
+                return True
+        self.logger.warning(f'Event trigger {TRIGGER_NAME} is not installed, '
+                            'datasets will not be cached. Install it with '
+                            'pgsqldoc-daemon install-trigger')
+        return False
+
+    def _process_notifications(self):
+        '''Mark datasets affected by received notifications as stale.'''
+
+        self._con.poll()
+        while self._con.notifies:
+            notify = self._con.notifies.pop(0)
+            if notify.channel != CHANNEL:
+                continue
+            affected = get_affected_datasets(notify.payload)
+            self.logger.debug(f'Got notification "{notify.payload}", '
+                              f'datasets to refresh: {affected}')
+            for stale in self._stale.values():
+                stale.update(affected)
+
+    def _collect(self, key: str, filters: dict):
+        stale = self._stale.get(key)
+        if key in self._cache and not stale:
+            self.logger.debug('Using cached datasets')
+            return
+        if key in self._cache:
+            datasets = tuple(d for d in DATASETS if d in stale)
+            self.logger.debug(f'Refreshing datasets: {datasets}')
+            self._cache[key].update(self._collector(Psycopg2Driver(self._con),
+                                                  filters, datasets))
+        else:
+            self.logger.debug('Collecting all datasets')
+            self._cache[key] = self._collector(Psycopg2Driver(self._con),
+                                                 filters, DATASETS)
+        self._stale[key] = set()
+
+    def get_datasets(self, filters: dict) -> dict:
+        '''
+        Return datasets collected with filters, fetching from the database
+        only those which were changed since the last call.
+        '''
+
+        if self._con is None or self._con.closed:
+            self.start()
+        key = json.dumps(filters, sort_keys=True, default=str)
+        try:
+            self._process_notifications()
+            if not self.listening:
+                self._cache.pop(key, None)
+            self._collect(key, filters)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # connection was lost, notifications could be missed as well
+            info = traceback.format_exc()
+            self.logger.debug(f'Connection lost, restarting:\n\n{info}')
+            self.start()
+            self._collect(key, filters)
+        return self._cache[key]
+
+
+_daemons = {}
+
+
+def get_daemon(dsn: str,
+               collector,
+               logger=None) -> CatalogDaemon:
+    '''
+    Return running daemon for the connection string, start a new one if it
+    doesn't exist yet.
+    '''
+
+    if dsn not in _daemons:
+        daemon = CatalogDaemon(dsn, collector, logger)
+        daemon.start()
+        _daemons[dsn] = daemon
+    return _daemons[dsn]
+
+
+def stop_daemons():
+    '''Stop all running daemons.'''
+
+    for daemon in _daemons.values():
+        daemon.stop()
+    _daemons.clear()
+
+
+class DaemonError(Exception):
+    '''Daemon failed to collect datasets.'''
+
+
+def get_socket_path() -> str:
+    '''Default path of the daemon socket, separate for each user.'''
+
+    return os.path.join(tempfile.gettempdir(),
+                        f'pgsqldoc-daemon-{getpass.getuser()}.sock')
+
+
+def request_datasets(socket_path: str,
+                     dsn: str,
+                     filters: dict) -> dict:
+    '''
+    Get datasets from the daemon listening on socket_path.
+
+    Raises OSError if the daemon is not running and DaemonError if it failed
+    to collect datasets.
+    '''
+
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError('Unix sockets are not supported on this platform')
+    request = json.dumps({'dsn': dsn, 'filters': filters}, default=str)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CLIENT_TIMEOUT)
+        sock.connect(socket_path)
+        sock.sendall(request.encode('utf8') + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('rb') as stream:
+            response = json.loads(stream.read())
+    if 'error' in response:
+        raise DaemonError(response['error'])
+    return response['data']
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    '''Handle one request: a JSON line with dsn and filters.'''
+
+    def handle(self):
+        logger = self.server.logger
+        try:
+            request = json.loads(self.rfile.readline())
+            daemon = get_daemon(request['dsn'],
+                                self.server.collector,
+                                logger)
+            response = {'data': daemon.get_datasets(request['filters'])}
+        except Exception as e:
+            info = traceback.format_exc()
+            logger.debug(f'Failed to handle request:\n\n{info}')
+            response = {'error': f'{type(e).__name__}: {e}'}
+        self.wfile.write(json.dumps(response, default=str).encode('utf8'))
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    '''
+    Serves datasets over a Unix socket, one request at a time, so that
+    database connections are never used concurrently.
+
+    socket_path (str) — path to the socket file, only its owner has access;
+    collector (callable) — see CatalogDaemon.
+    '''
+
+    def __init__(self, socket_path: str, collector, logger=None):
+        self.collector = collector
+        self.logger = logger or getLogger('pgsqldoc.daemon')
+        self._remove_stale_socket(socket_path)
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, DaemonRequestHandler)
+        finally:
+            os.umask(umask)
+
+    @staticmethod
+    def _remove_stale_socket(socket_path: str):
+        if not os.path.exists(socket_path):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+            except OSError:
+                os.remove(socket_path)
+                return
+        raise OSError(f'Daemon is already running on {socket_path}')
+
+    def server_close(self):
+        super().server_close()
+        stop_daemons()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def install_trigger(dsn: str):
+    '''Create the event trigger and its function in the database.'''
+
+    with psycopg2.connect(dsn) as con:
+        with con.cursor() as cur:
+            cur.execute(UNINSTALL_SQL)
+            cur.execute(INSTALL_SQL)
+    con.close()
+
+
+def uninstall_trigger(dsn: str):
+    '''Drop the event trigger and its function from the database.'''
+
+    with psycopg2.connect(dsn) as con:
+        with con.cursor() as cur:
+            cur.execute(UNINSTALL_SQL)
+    con.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='pgsqldoc-daemon',
+        description='Catalog daemon for foliantcontrib.pgsqldoc')
+    parser.add_argument('--debug', action='store_true',
+                        help='log debug messages')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser(
+        'serve', help='run the daemon (default command)')
+    serve_parser.add_argument('--socket', default=get_socket_path(),
+                              help='path to the socket file')
+    for command in ('install-trigger', 'uninstall-trigger'):
+        command_parser = subparsers.add_parser(
+            command, help=f'{command.split("-")[0]} the DDL event trigger '
+                          '(requires superuser privileges)')
+        command_parser.add_argument('dsn', help='libpq connection string')
+    parsed = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if parsed.debug else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    logger = getLogger('pgsqldoc.daemon')
+
+    if parsed.command == 'install-trigger':
+        install_trigger(parsed.dsn)
+        logger.info(f'Event trigger {TRIGGER_NAME} installed')
+    elif parsed.command == 'uninstall-trigger':
+        uninstall_trigger(parsed.dsn)
+        logger.info(f'Event trigger {TRIGGER_NAME} removed')
+    else:
+        # imported here to avoid circular import with the preprocessor module
+        from .pgsqldoc import collect_datasets
+
+        socket_path = getattr(parsed, 'socket', None) or get_socket_path()
+        # close connections and remove the socket file on termination
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        with DaemonServer(socket_path, collect_datasets, logger) as server:
+            logger.info(f'Serving on {socket_path}')
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == '__main__':
+    main()
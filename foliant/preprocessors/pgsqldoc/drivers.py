@@ -0,0 +1,207 @@
+'''
+Database drivers used to run catalog queries.
+
+psycopg2 driver runs queries one by one through a single connection.
+asyncpg driver (requires asyncpg package) uses binary protocol and runs
+all queries concurrently through a connection pool on its own event loop.
+'''
+
+import asyncio
+import psycopg2
+
+from .utils import quote_dsn_value
+from abc import ABCMeta
+from abc import abstractmethod
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+ASYNCPG_POOL_SIZE = 8
+
+
+def get_dsn(options,
+            target_session_attrs: str = None) -> str:
+    '''
+    Build libpq connection string from connection parameters in options.
+
+    host and port options may contain several comma-separated values. In this
+    case libpq tries the hosts in turn (each for no longer than
+    connect_timeout seconds) and picks the first one with matching
+    target_session_attrs.
+
+    target_session_attrs (str) — overrides the target_session_attrs option.
+    '''
+
+    params = {'host': options['host'],
+              'port': options['port'],
+              'dbname': options['dbname'],
+              'user': options['user'],
+              'password': options['password'],
+              'connect_timeout': options['connect_timeout']}
+    if ',' in str(options['host']):
+        params['target_session_attrs'] = target_session_attrs or \
+            options['target_session_attrs']
+    if options['load_balance_hosts']:
+        params['load_balance_hosts'] = options['load_balance_hosts']
+    return ' '.join(f"{key}='{quote_dsn_value(value)}'"
+                    for key, value in params.items())
+
+
+def get_connect_kwargs(options) -> dict:
+    '''
+    Build asyncpg connection arguments from connection parameters in options.
+
+    Unlike libpq, asyncpg applies connect_timeout to the whole connection
+    attempt rather than to each host, so an unresponsive host takes up all
+    of it and the hosts after it are not tried. load_balance_hosts option is
+    not supported by asyncpg and is ignored.
+    '''
+
+    hosts = str(options['host']).split(',')
+    ports = [int(port) for port in str(options['port']).split(',')]
+    result = {'host': hosts if len(hosts) > 1 else hosts[0],
+              'port': ports if len(ports) > 1 else ports[0],
+              'database': options['dbname'],
+              'user': options['user'],
+              'password': options['password'],
+              'timeout': float(options['connect_timeout'])}
+    if len(hosts) > 1:
+        result['target_session_attrs'] = options['target_session_attrs']
+    return result
+
+
+class DriverBase(metaclass=ABCMeta):
+    '''
+    Runs SQL queries and returns rows as lists of dicts with column names
+    as keys. NULL values are replaced with empty strings.
+    '''
+
+    # exceptions raised when database is unreachable
+    connection_errors = ()
+
+    @classmethod
+    @abstractmethod
+    def connect(cls, options):
+        '''Connect to the database using parameters from options.'''
+
+    @property
+    @abstractmethod
+    def host(self) -> str:
+        '''Address of the server the driver is connected to.'''
+
+    @abstractmethod
+    def fetch_all(self, sqls: list) -> list:
+        '''Run all queries from sqls and return list of their results.'''
+
+    @abstractmethod
+    def close(self):
+        '''Close the connection.'''
+
+    def fetch(self, sql: str) -> list:
+        '''Run one query and return its rows.'''
+        return self.fetch_all([sql])[0]
+
+
+class Psycopg2Driver(DriverBase):
+
+    connection_errors = (psycopg2.OperationalError,)
+
+    def __init__(self, con: psycopg2.extensions.connection):
+        self._con = con
+
+    @classmethod
+    def connect(cls, options):
+        return cls(psycopg2.connect(get_dsn(options)))
+
+    @property
+    def host(self) -> str:
+        return self._con.info.host
+
+    def fetch(self, sql: str) -> list:
+        cur = self._con.cursor()
+        cur.execute(sql)
+        result = []
+        keys = tuple((d[0] for d in cur.description))
+        for row in cur.fetchall():
+            row_dict = {}
+            for i in range(len(keys)):
+                row_dict[keys[i]] = row[i] or ''
+            result.append(row_dict)
+        return result
+
+    def fetch_all(self, sqls: list) -> list:
+        return [self.fetch(sql) for sql in sqls]
+
+    def close(self):
+        self._con.close()
+
+
+class AsyncpgDriver(DriverBase):
+
+    # InternalClientError is the base of TargetServerAttributeNotMatched,
+    # which is missing in older asyncpg versions
+    connection_errors = (OSError, asyncio.TimeoutError) + \
+        ((asyncpg.PostgresError,
+          asyncpg.InterfaceError,
+          asyncpg.exceptions.InternalClientError) if asyncpg else ())
+
+    def __init__(self, pool, loop: asyncio.AbstractEventLoop):
+        self._pool = pool
+        self._loop = loop
+
+    @classmethod
+    def connect(cls, options):
+        if asyncpg is None:
+            raise ImportError('asyncpg driver requires asyncpg package: '
+                              'pip install foliantcontrib.pgsqldoc[asyncpg]')
+        connect_kwargs = get_connect_kwargs(options)
+
+        async def _create_pool():
+            # pool must be created inside the loop it will be used in
+            return await asyncpg.create_pool(min_size=1,
+                                             max_size=ASYNCPG_POOL_SIZE,
+                                             **connect_kwargs)
+
+        loop = asyncio.new_event_loop()
+        try:
+            pool = loop.run_until_complete(_create_pool())
+        except Exception:
+            loop.close()
+            raise
+        return cls(pool, loop)
+
+    @property
+    def host(self) -> str:
+        rows = self.fetch('SELECT host(inet_server_addr()) AS host')
+        return rows[0]['host'] or 'local socket'
+
+    async def _fetch(self, sql: str) -> list:
+        async with self._pool.acquire() as con:
+            records = await con.fetch(sql)
+        return [{key: value or '' for key, value in record.items()}
+                for record in records]
+
+    async def _fetch_all(self, sqls: list) -> list:
+        return await asyncio.gather(*(self._fetch(sql) for sql in sqls))
+
+    def fetch_all(self, sqls: list) -> list:
+        return self._loop.run_until_complete(self._fetch_all(sqls))
+
+    def close(self):
+        self._loop.run_until_complete(self._pool.close())
+        self._loop.close()
+
+
+DRIVERS = {'psycopg2': Psycopg2Driver,
+           'asyncpg': AsyncpgDriver}
+
+
+def get_driver(name: str):
+    '''Return driver class by its name.'''
+
+    if name not in DRIVERS:
+        raise ValueError(f'Unknown driver {name}. '
+                         f'Available drivers: {", ".join(DRIVERS)}')
+    return DRIVERS[name]
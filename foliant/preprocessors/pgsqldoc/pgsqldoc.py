@@ -3,15 +3,24 @@ Preprocessor for Foliant documentation authoring tool.
 Generates documentation from PostgreSQL database structure,
 '''
 
+import logging
 import psycopg2
 import traceback
 
+from .daemon import DaemonError
+from .daemon import get_socket_path
+from .daemon import request_datasets
+from .drivers import DriverBase
+from .drivers import get_driver
+from .drivers import get_dsn
 from .queries import ColumnsQuery
+from .queries import DATASETS
 from .queries import ForeignKeysQuery
 from .queries import FunctionsQuery
 from .queries import ParametersQuery
 from .queries import TablesQuery
 from .queries import TriggersQuery
+from .utils import comma_separated_convertor
 from .utils import copy_if_not_exists
 from copy import deepcopy
 from foliant.contrib.combined_options import CombinedOptions
@@ -23,27 +32,63 @@ from jinja2 import FileSystemLoader
 from pkg_resources import resource_filename
 
 
-def collect_datasets(connection,
-                     filters: dict) -> dict:
+DATASET_QUERIES = {'tables': (TablesQuery, ColumnsQuery, ForeignKeysQuery),
+                   'functions': (FunctionsQuery, ParametersQuery),
+                   'triggers': (TriggersQuery,)}
 
-        result = {}
 
-        tables = TablesQuery(connection, filters).run()
-        columns = ColumnsQuery(connection, filters).run()
-        fks = ForeignKeysQuery(connection, filters).run()
+def collect_datasets(connection: DriverBase,
+                     filters: dict,
+                     datasets: tuple = DATASETS) -> dict:
+    '''
+    Run catalog queries and collect results into a dictionary with keys
+    'tables', 'functions' and 'triggers'.
 
-        # fill each table with columns and foreign keys
-        result['tables'] = collect_tables(tables, columns, fks)
+    datasets (tuple) — names of the datasets to collect. Used to refresh only
+                       a part of the previously collected data.
+    '''
 
-        functions = FunctionsQuery(connection, filters).run()
-        parameters = ParametersQuery(connection, filters).run()
+    return collect_datasets_many(connection, [filters], datasets)[0]
 
-        # fill each function with its parameters
 
-        result['functions'] = collect_functions(functions, parameters)
+def collect_datasets_many(connection: DriverBase,
+                          filters_list: list,
+                          datasets: tuple = DATASETS) -> list:
+    '''
+    Same as collect_datasets but for several sets of filters. Queries for all
+    of them are passed to the driver at once, so drivers which support it
+    can run them concurrently.
 
-        result['triggers'] = TriggersQuery(connection, filters).run()
-        return result
+    returns list of collected datasets for each item of filters_list.
+    '''
+
+    query_classes = [q for d in DATASETS if d in datasets
+                     for q in DATASET_QUERIES[d]]
+    sqls = [query_class(connection, filters).get_sql()
+            for filters in filters_list
+            for query_class in query_classes]
+    rows = iter(connection.fetch_all(sqls))
+
+    result = []
+    for _ in filters_list:
+        fetched = {query_class: next(rows) for query_class in query_classes}
+        data = {}
+
+        if 'tables' in datasets:
+            # fill each table with columns and foreign keys
+            data['tables'] = collect_tables(fetched[TablesQuery],
+                                            fetched[ColumnsQuery],
+                                            fetched[ForeignKeysQuery])
+
+        if 'functions' in datasets:
+            # fill each function with its parameters
+            data['functions'] = collect_functions(fetched[FunctionsQuery],
+                                                  fetched[ParametersQuery])
+
+        if 'triggers' in datasets:
+            data['triggers'] = fetched[TriggersQuery]
+        result.append(data)
+    return result
 
 
 def collect_tables(tables: list,
@@ -99,9 +144,15 @@ class Preprocessor(BasePreprocessor):
         'draw': False,
         'host': 'localhost',
         'port': '5432',
+        'connect_timeout': 10,
+        'target_session_attrs': 'prefer-standby',
+        'load_balance_hosts': '',
+        'driver': 'psycopg2',
         'dbname': 'postgres',
         'user': 'postgres',
         'password': '',
+        'daemon': False,
+        'daemon_socket': '',
         'filters': {},
         'doc_template': 'pgsqldoc.j2',
         'scheme_template': 'scheme.j2'
@@ -145,8 +196,8 @@ class Preprocessor(BasePreprocessor):
         return result
 
     def _gen_docs(self,
-                  options: CombinedOptions) -> str:
-        data = collect_datasets(self._con, options['filters'])
+                  options: CombinedOptions,
+                  data: dict) -> str:
         docs = self._to_md(data, options['doc_template'])
         if options['draw']:
             docs += '\n\n' + self._to_diag(data,
@@ -156,22 +207,23 @@ class Preprocessor(BasePreprocessor):
     def _connect(self, options: CombinedOptions):
         """
         Connect to PostgreSQL database using parameters from options.
-        Save connection object into self._con.
+        Save driver object into self._con.
 
         options(CombinedOptions) — CombinedOptions object with options from tag
                                    and config.
         """
+        driver = get_driver(options['driver'])
         try:
             self._con = None
-            self.logger.debug(f"Trying to connect: host={options['host']} port={options['port']}"
+            self.logger.debug(f"Trying to connect with {options['driver']}: "
+                              f"host={options['host']} port={options['port']}"
                               f" dbname={options['dbname']}, user={options['user']} "
                               f"password={options['password']}.")
-            self._con = psycopg2.connect(f"host='{options['host']}' "
-                                         f"port='{options['port']}' "
-                                         f"dbname='{options['dbname']}' "
-                                         f"user='{options['user']}'"
-                                         f"password='{options['password']}'")
-        except psycopg2.OperationalError:
+            self._con = driver.connect(options)
+            # getting host may need an extra query
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(f'Connected to host {self._con.host}')
+        except driver.connection_errors:
             info = traceback.format_exc()
             output(f"\nFailed to connect to host {options['host']}. "
                    'Documentation was not generated', self.quiet)
@@ -182,6 +234,28 @@ class Preprocessor(BasePreprocessor):
                               f'password={options["password"]}.\n\n{info}')
             raise psycopg2.OperationalError
 
+    def _get_daemon_datasets(self, options: CombinedOptions):
+        """
+        Get datasets from the catalog daemon for the connection parameters
+        in options. Returns None if the daemon is not running or failed, so
+        that the datasets are collected directly.
+
+        options(CombinedOptions) — CombinedOptions object with options from tag
+                                   and config.
+        """
+        socket_path = options['daemon_socket'] or get_socket_path()
+        try:
+            # notifications are not delivered on standby servers
+            return request_datasets(socket_path,
+                                    get_dsn(options, 'read-write'),
+                                    options['filters'])
+        except (OSError, DaemonError):
+            info = traceback.format_exc()
+            self.logger.debug(f'Failed to get datasets from catalog daemon on '
+                              f'{socket_path}, querying database directly.'
+                              f'\n\n{info}')
+            return None
+
     def _create_default_templates(self, options: CombinedOptions):
         """
         Copy default templates to project dir if their names in options are
@@ -200,20 +274,66 @@ class Preprocessor(BasePreprocessor):
                                         f"templates/{options.defaults['scheme_template']}")
             copy_if_not_exists(source, to_copy)
 
+    def _collect_blocks_datasets(self, blocks_options: list) -> list:
+        """
+        Collect datasets for all tags in a document. Tags with the same
+        driver and connection parameters share one connection and their
+        queries are passed to the driver together. With psycopg2 driver and
+        load_balance_hosts option each tag gets its own connection.
+
+        blocks_options(list) — list of CombinedOptions objects for each tag.
+
+        returns list of datasets for each tag.
+        """
+        result = [None] * len(blocks_options)
+        groups = {}
+        for i, options in enumerate(blocks_options):
+            if options['daemon']:
+                result[i] = self._get_daemon_datasets(options)
+            if result[i] is None:
+                key = (options['driver'], get_dsn(options))
+                if options['driver'] == 'psycopg2' and \
+                        options['load_balance_hosts']:
+                    # separate connection for each tag to spread them
+                    # across replicas
+                    key += (i,)
+                groups.setdefault(key, []).append(i)
+
+        for indexes in groups.values():
+            self._connect(blocks_options[indexes[0]])
+            if not self._con:
+                continue
+            try:
+                filters_list = [blocks_options[i]['filters'] for i in indexes]
+                datasets = collect_datasets_many(self._con, filters_list)
+            finally:
+                self._con.close()
+            for i, data in zip(indexes, datasets):
+                result[i] = data
+        return result
+
     def process_pgsqldoc_blocks(self, content: str) -> str:
-        def _sub(block) -> str:
+        blocks_options = []
+        for block in self.pattern.finditer(content):
             tag_options = self.get_options(block.group('options'))
             options = CombinedOptions({'config': self.options,
                                        'tag': tag_options},
                                       priority='tag',
-                                      convertors={'filters': yaml_to_dict_convertor},
+                                      convertors={'filters': yaml_to_dict_convertor,
+                                                  'host': comma_separated_convertor,
+                                                  'port': comma_separated_convertor},
                                       defaults=self.defaults)
-            self._connect(options)
-            if not self._con:
+            blocks_options.append(options)
+        blocks_datasets = self._collect_blocks_datasets(blocks_options)
+        blocks = iter(zip(blocks_options, blocks_datasets))
+
+        def _sub(block) -> str:
+            options, data = next(blocks)
+            if data is None:
                 return ''
 
             self._create_default_templates(options)
-            return self._gen_docs(options)
+            return self._gen_docs(options, data)
         return self.pattern.sub(_sub, content)
 
     def apply(self):
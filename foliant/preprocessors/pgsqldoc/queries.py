@@ -1,9 +1,11 @@
-import psycopg2
+from .drivers import DriverBase
 from abc import ABCMeta
 
 SCHEMA = 'schema'
 TABLE_NAME = 'table_name'
 
+DATASETS = ('tables', 'functions', 'triggers')
+
 
 class QueryBase(metaclass=ABCMeta):
 
@@ -13,7 +15,7 @@ class QueryBase(metaclass=ABCMeta):
     # sort_fields = {}
 
     def __init__(self,
-                 con: psycopg2.extensions.connection,
+                 con: DriverBase,
                  filters: dict = {}):
         self._con = con
         self._filters = self._resolve_filters(filters)
@@ -81,20 +83,13 @@ class QueryBase(metaclass=ABCMeta):
     def _get_rows(self, sql) -> list:
         """Run query from sql param and return a list of dicts key=column name,
         value = field value"""
-        cur = self._con.cursor()
-        cur.execute(sql)
-        result = []
-        keys = tuple((d[0] for d in cur.description))
-        for row in cur.fetchall():
-            row_dict = {}
-            for i in range(len(keys)):
-                row_dict[keys[i]] = row[i] or ''
-            result.append(row_dict)
-        return result
+        return self._con.fetch(sql)
+
+    def get_sql(self) -> str:
+        return self.base_query.format(filters=self._filters)
 
     def run(self):
-        sql = self.base_query.format(filters=self._filters)
-        return self._get_rows(sql)
+        return self._get_rows(self.get_sql())
 
 
 class TablesQuery(QueryBase):
@@ -0,0 +1,156 @@
+import os
+import psycopg2
+import tempfile
+import threading
+import time
+from unittest import TestCase, skipUnless
+from unittest.mock import MagicMock, Mock, patch
+from pgsqldoc.daemon import CatalogDaemon, DaemonError, DaemonServer
+from pgsqldoc.daemon import get_affected_datasets, request_datasets
+from pgsqldoc.daemon import install_trigger, uninstall_trigger
+from pgsqldoc.pgsqldoc import collect_datasets
+
+TEST_DSN = os.environ.get('PGSQLDOC_TEST_DSN')
+
+
+class TestGetAffectedDatasets(TestCase):
+    def test_comment_on_column(self):
+        self.assertEqual(get_affected_datasets('COMMENT|,table column'),
+                         {'tables'})
+
+    def test_create_function(self):
+        self.assertEqual(get_affected_datasets('CREATE FUNCTION|,function'),
+                         {'functions', 'triggers'})
+
+    def test_drop_trigger(self):
+        self.assertEqual(get_affected_datasets('DROP TRIGGER|'),
+                         {'triggers'})
+
+    def test_unknown_command(self):
+        self.assertEqual(get_affected_datasets('CREATE TYPE|,type'),
+                         {'tables', 'functions', 'triggers'})
+
+
+class TestCatalogDaemonCache(TestCase):
+    def setUp(self):
+        self.collector = Mock(side_effect=lambda con, filters, datasets:
+                              {d: [d] for d in datasets})
+        self.daemon = CatalogDaemon('dsn', self.collector, Mock())
+        self.con = MagicMock(closed=False, notifies=[])
+        self.psycopg2_patcher = patch('pgsqldoc.daemon.psycopg2')
+        psycopg2_mock = self.psycopg2_patcher.start()
+        psycopg2_mock.connect.return_value = self.con
+        psycopg2_mock.Error = psycopg2.Error
+        psycopg2_mock.OperationalError = psycopg2.OperationalError
+        psycopg2_mock.InterfaceError = psycopg2.InterfaceError
+
+    def tearDown(self):
+        self.psycopg2_patcher.stop()
+
+    def _notify(self, payload):
+        self.con.notifies.append(Mock(channel='pgsqldoc_ddl', payload=payload))
+
+    def test_datasets_are_cached(self):
+        first = self.daemon.get_datasets({})
+        second = self.daemon.get_datasets({})
+        self.assertEqual(first, second)
+        self.assertEqual(self.collector.call_count, 1)
+
+    def test_filters_are_cached_separately(self):
+        self.daemon.get_datasets({})
+        self.daemon.get_datasets({'eq': {'schema': 'public'}})
+        self.assertEqual(self.collector.call_count, 2)
+
+    def test_only_affected_datasets_are_refreshed(self):
+        self.daemon.get_datasets({})
+        self._notify('COMMENT|,table column')
+        self.daemon.get_datasets({})
+        self.assertEqual(self.collector.call_count, 2)
+        self.assertEqual(self.collector.call_args[0][2], ('tables',))
+
+    def test_no_cache_without_trigger(self):
+        with patch.object(CatalogDaemon, '_check_trigger', return_value=False):
+            self.daemon.get_datasets({})
+            self.daemon.get_datasets({})
+        self.assertEqual(self.collector.call_count, 2)
+        self.assertEqual(self.con.cursor.call_count, 0)
+
+
+class TestDaemonServer(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmp_dir.name, 'daemon.sock')
+        self.server = DaemonServer(self.socket_path, Mock(), Mock())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_request_datasets(self):
+        data = {'tables': [{'relname': 'table'}], 'functions': [],
+                'triggers': []}
+        daemon = Mock()
+        daemon.get_datasets.return_value = data
+        with patch('pgsqldoc.daemon.get_daemon', return_value=daemon) as get_daemon:
+            got = request_datasets(self.socket_path, 'dsn', {'eq': {'schema': 'public'}})
+        self.assertEqual(got, data)
+        self.assertEqual(get_daemon.call_args[0][0], 'dsn')
+        daemon.get_datasets.assert_called_once_with({'eq': {'schema': 'public'}})
+
+    def test_daemon_error(self):
+        with patch('pgsqldoc.daemon.get_daemon',
+                   side_effect=psycopg2.OperationalError('no host')):
+            with self.assertRaises(DaemonError):
+                request_datasets(self.socket_path, 'dsn', {})
+
+    def test_second_server_on_same_socket(self):
+        with self.assertRaises(OSError):
+            DaemonServer(self.socket_path, Mock(), Mock())
+
+    def test_socket_is_private(self):
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o777, 0o600)
+
+
+class TestRequestDatasetsNoDaemon(TestCase):
+    def test_daemon_not_running(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaises(OSError):
+                request_datasets(os.path.join(tmp_dir, 'daemon.sock'), 'dsn', {})
+
+
+@skipUnless(TEST_DSN, 'PGSQLDOC_TEST_DSN is not set')
+class TestCatalogDaemonLive(TestCase):
+    def setUp(self):
+        self.con = psycopg2.connect(TEST_DSN)
+        self.con.autocommit = True
+        with self.con.cursor() as cur:
+            cur.execute('CREATE TABLE IF NOT EXISTS pgsqldoc_test (id integer)')
+        install_trigger(TEST_DSN)
+        self.daemon = CatalogDaemon(TEST_DSN, collect_datasets)
+        self.filters = {'eq': {'table_name': 'pgsqldoc_test'}}
+
+    def tearDown(self):
+        self.daemon.stop()
+        uninstall_trigger(TEST_DSN)
+        with self.con.cursor() as cur:
+            cur.execute('DROP TABLE IF EXISTS pgsqldoc_test')
+        self.con.close()
+
+    def test_comment_refreshes_tables(self):
+        data = self.daemon.get_datasets(self.filters)
+        self.assertTrue(self.daemon.listening)
+        self.assertEqual(data['tables'][0]['description'], '')
+
+        with self.con.cursor() as cur:
+            cur.execute("COMMENT ON TABLE pgsqldoc_test IS 'test table'")
+        deadline = time.time() + 5
+        data = self.daemon.get_datasets(self.filters)
+        while not data['tables'][0]['description'] and time.time() < deadline:
+            time.sleep(0.1)
+            data = self.daemon.get_datasets(self.filters)
+
+        self.assertEqual(data['tables'][0]['description'], 'test table')
@@ -0,0 +1,204 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from psycopg2.extensions import parse_dsn
+from unittest import TestCase, skipUnless
+from unittest.mock import MagicMock, patch
+from pgsqldoc.drivers import AsyncpgDriver, Psycopg2Driver, asyncpg, get_driver
+from pgsqldoc.drivers import get_connect_kwargs
+from pgsqldoc.pgsqldoc import Preprocessor, collect_datasets_many
+from pgsqldoc.queries import TablesQuery
+
+TEST_DSN = os.environ.get('PGSQLDOC_TEST_DSN')
+
+RESULTS = {'SELECT a, b FROM t': [{'a': 1, 'b': None},
+                                  {'a': None, 'b': 'x'}],
+           'SELECT c FROM t': [{'c': 'y'}]}
+
+
+class FakeCursor:
+    def __init__(self, results):
+        self._results = results
+        self._rows = []
+
+    def execute(self, sql):
+        self._rows = self._results.get(sql, [])
+
+    @property
+    def description(self):
+        return [(key,) for key in (self._rows[0] if self._rows else {})]
+
+    def fetchall(self):
+        return [tuple(row.values()) for row in self._rows]
+
+
+class FakeAsyncpgConnection:
+    def __init__(self, results):
+        self._results = results
+
+    async def fetch(self, sql):
+        await asyncio.sleep(0)
+        return self._results.get(sql, [])
+
+
+class FakeAsyncpgPool:
+    def __init__(self, results):
+        self._results = results
+        self.acquired = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.acquired += 1
+        yield FakeAsyncpgConnection(self._results)
+
+    async def close(self):
+        pass
+
+
+class DriverTestsMixin:
+    # subclasses define make_driver(results) returning driver which gets
+    # rows from results dict: sql -> list of rows
+
+    def test_fetch_replaces_nulls(self):
+        driver = self.make_driver(RESULTS)
+        self.assertEqual(driver.fetch('SELECT a, b FROM t'),
+                         [{'a': 1, 'b': ''}, {'a': '', 'b': 'x'}])
+        driver.close()
+
+    def test_fetch_all_keeps_order(self):
+        driver = self.make_driver(RESULTS)
+        self.assertEqual(driver.fetch_all(['SELECT c FROM t',
+                                           'SELECT a, b FROM t']),
+                         [[{'c': 'y'}],
+                          [{'a': 1, 'b': ''}, {'a': '', 'b': 'x'}]])
+        driver.close()
+
+    def test_collect_datasets_many(self):
+        filters_list = [{}, {'eq': {'table_name': 'table'}}]
+        table = {'schemaname': 'public', 'relname': 'table', 'description': 'd'}
+        results = {TablesQuery(None, filters).get_sql(): [table]
+                   for filters in filters_list}
+        driver = self.make_driver(results)
+        datasets = collect_datasets_many(driver, filters_list)
+        driver.close()
+        self.assertEqual(len(datasets), 2)
+        for data in datasets:
+            self.assertEqual(data['tables'], [{**table, 'columns': []}])
+            self.assertEqual(data['functions'], [])
+            self.assertEqual(data['triggers'], [])
+
+
+class TestPsycopg2Driver(DriverTestsMixin, TestCase):
+    def make_driver(self, results):
+        con = MagicMock()
+        con.cursor.side_effect = lambda: FakeCursor(results)
+        return Psycopg2Driver(con)
+
+
+class TestAsyncpgDriver(DriverTestsMixin, TestCase):
+    def make_driver(self, results):
+        self.pool = FakeAsyncpgPool(results)
+        return AsyncpgDriver(self.pool, asyncio.new_event_loop())
+
+    def test_queries_use_pool(self):
+        driver = self.make_driver(RESULTS)
+        driver.fetch_all(['SELECT c FROM t', 'SELECT a, b FROM t'])
+        driver.close()
+        self.assertEqual(self.pool.acquired, 2)
+
+
+@skipUnless(asyncpg, 'asyncpg is not installed')
+class TestAsyncpgDriverConnect(TestCase):
+    def setUp(self):
+        self.options = {**Preprocessor.defaults,
+                        'host': 'primary,standby',
+                        'port': '5432,5433'}
+
+    def test_pool_is_created_on_driver_loop(self):
+        calls = []
+
+        async def create_pool(**kwargs):
+            calls.append((asyncio.get_running_loop(), kwargs))
+            return FakeAsyncpgPool(RESULTS)
+
+        with patch('pgsqldoc.drivers.asyncpg.create_pool', create_pool):
+            driver = AsyncpgDriver.connect(self.options)
+        self.assertEqual(len(calls), 1)
+        loop, kwargs = calls[0]
+        self.assertIs(loop, driver._loop)
+        self.assertEqual(kwargs['host'], ['primary', 'standby'])
+        self.assertEqual(driver.fetch('SELECT c FROM t'), [{'c': 'y'}])
+        driver.close()
+
+    def test_target_server_mismatch_is_connection_error(self):
+        async def create_pool(**kwargs):
+            raise asyncpg.exceptions.TargetServerAttributeNotMatched()
+
+        with patch('pgsqldoc.drivers.asyncpg.create_pool', create_pool):
+            with self.assertRaises(AsyncpgDriver.connection_errors):
+                AsyncpgDriver.connect(self.options)
+
+
+class TestGetConnectKwargs(TestCase):
+    def test_several_hosts(self):
+        options = {**Preprocessor.defaults,
+                   'host': 'primary,standby',
+                   'port': '5432,5433',
+                   'connect_timeout': 3}
+        self.assertEqual(get_connect_kwargs(options),
+                         {'host': ['primary', 'standby'],
+                          'port': [5432, 5433],
+                          'database': 'postgres',
+                          'user': 'postgres',
+                          'password': '',
+                          'timeout': 3.0,
+                          'target_session_attrs': 'prefer-standby'})
+
+    def test_single_host(self):
+        kwargs = get_connect_kwargs(Preprocessor.defaults)
+        self.assertEqual(kwargs['host'], 'localhost')
+        self.assertEqual(kwargs['port'], 5432)
+        self.assertNotIn('target_session_attrs', kwargs)
+
+
+class TestGetDriver(TestCase):
+    def test_known_drivers(self):
+        self.assertIs(get_driver('psycopg2'), Psycopg2Driver)
+        self.assertIs(get_driver('asyncpg'), AsyncpgDriver)
+
+    def test_unknown_driver(self):
+        with self.assertRaises(ValueError):
+            get_driver('wrong_driver')
+
+
+class LiveDriverTestsMixin:
+    driver_class = None
+
+    def setUp(self):
+        options = {**Preprocessor.defaults, **parse_dsn(TEST_DSN)}
+        self.driver = self.driver_class.connect(options)
+
+    def tearDown(self):
+        self.driver.close()
+
+    def test_fetch(self):
+        self.assertEqual(self.driver.fetch('SELECT 1 AS one, NULL AS empty'),
+                         [{'one': 1, 'empty': ''}])
+
+    def test_collect_datasets_many(self):
+        filters_list = [{'eq': {'schema': 'pg_catalog'}},
+                        {'eq': {'schema': 'information_schema'}}]
+        datasets = collect_datasets_many(self.driver, filters_list)
+        self.assertEqual(len(datasets), 2)
+        self.assertTrue(datasets[0]['tables'])
+
+
+@skipUnless(TEST_DSN, 'PGSQLDOC_TEST_DSN is not set')
+class TestPsycopg2DriverLive(LiveDriverTestsMixin, TestCase):
+    driver_class = Psycopg2Driver
+
+
+@skipUnless(TEST_DSN and asyncpg, 'PGSQLDOC_TEST_DSN is not set or asyncpg '
+                                  'is not installed')
+class TestAsyncpgDriverLive(LiveDriverTestsMixin, TestCase):
+    driver_class = AsyncpgDriver
@@ -2,7 +2,7 @@ import psycopg2
 from unittest import TestCase
 from unittest.mock import Mock, patch, call, DEFAULT
 from pathlib import Path
-from pgsqldoc.pgsqldoc import Preprocessor
+from pgsqldoc.pgsqldoc import Preprocessor, get_dsn
 from foliant.contrib.combined_options import CombinedOptions
 
 
@@ -13,15 +13,20 @@ class TestPreprocessorDB(TestCase):
                         'port': 'port',
                         'dbname': 'dbname',
                         'user': 'user',
-                        'password': 'password'}
+                        'password': 'password',
+                        'connect_timeout': 10,
+                        'target_session_attrs': 'prefer-standby',
+                        'load_balance_hosts': '',
+                        'driver': 'psycopg2'}
         self.connect_string = f"host='{self.options['host']}' "\
                               f"port='{self.options['port']}' "\
                               f"dbname='{self.options['dbname']}' "\
-                              f"user='{self.options['user']}'"\
-                              f"password='{self.options['password']}'"
+                              f"user='{self.options['user']}' "\
+                              f"password='{self.options['password']}' "\
+                              f"connect_timeout='10'"
 
     def test_connect_success(self):
-        with patch('pgsqldoc.pgsqldoc.psycopg2') as mock:
+        with patch('pgsqldoc.drivers.psycopg2') as mock:
             Preprocessor._connect(self.preprocessor, self.options)
             mock.assert_has_calls([call.connect(self.connect_string)])
             self.assertIsNotNone(self.preprocessor._con)
@@ -30,18 +35,88 @@ class TestPreprocessorDB(TestCase):
         psycopg2_mock = Mock()
         psycopg2_mock.OperationalError = psycopg2.OperationalError
         psycopg2_mock.connect.side_effect = psycopg2.OperationalError()
-        with patch.multiple('pgsqldoc.pgsqldoc',
-                            psycopg2=psycopg2_mock,
-                            output=DEFAULT) as mock:
+        with patch('pgsqldoc.drivers.psycopg2', psycopg2_mock), \
+                patch('pgsqldoc.pgsqldoc.output') as output_mock:
             with self.assertRaises(psycopg2.OperationalError):
                 Preprocessor._connect(self.preprocessor, self.options)
             psycopg2_mock.assert_has_calls([call.connect(self.connect_string)])
-            self.assertTrue(mock['output'].called)
+            self.assertTrue(output_mock.called)
             self.assertIsNone(self.preprocessor._con)
             # logger was called 2 times: first 'Trying to connect'
             # second 'Failed to connect'
             self.assertEqual(self.preprocessor.logger.debug.call_count, 2)
 
+    def test_daemon_not_running(self):
+        options = {**self.options,
+                   'daemon_socket': '/nonexistent/pgsqldoc-daemon.sock',
+                   'filters': {}}
+        self.assertIsNone(Preprocessor._get_daemon_datasets(self.preprocessor,
+                                                            options))
+
+
+class TestCollectBlocksDatasets(TestCase):
+    def setUp(self):
+        self.preprocessor = Mock()
+        self.options = {'host': 'primary,standby',
+                        'port': 'port',
+                        'dbname': 'dbname',
+                        'user': 'user',
+                        'password': 'password',
+                        'connect_timeout': 10,
+                        'target_session_attrs': 'prefer-standby',
+                        'load_balance_hosts': '',
+                        'driver': 'psycopg2',
+                        'daemon': False,
+                        'filters': {}}
+
+    def _collect(self, blocks_options):
+        with patch('pgsqldoc.pgsqldoc.collect_datasets_many',
+                   side_effect=lambda con, filters_list: [{}] * len(filters_list)):
+            return Preprocessor._collect_blocks_datasets(self.preprocessor,
+                                                         blocks_options)
+
+    def test_tags_share_connection(self):
+        result = self._collect([self.options, self.options])
+        self.assertEqual(result, [{}, {}])
+        self.assertEqual(self.preprocessor._connect.call_count, 1)
+
+    def test_load_balance_hosts_connection_per_tag(self):
+        self.options['load_balance_hosts'] = 'random'
+        result = self._collect([self.options, self.options])
+        self.assertEqual(result, [{}, {}])
+        self.assertEqual(self.preprocessor._connect.call_count, 2)
+
+
+class TestGetDsn(TestCase):
+    def setUp(self):
+        self.options = {'host': 'primary,standby',
+                        'port': '5432,5433',
+                        'dbname': 'dbname',
+                        'user': 'user',
+                        'password': "pass'word",
+                        'connect_timeout': 3,
+                        'target_session_attrs': 'prefer-standby',
+                        'load_balance_hosts': ''}
+
+    def test_several_hosts(self):
+        self.assertEqual(get_dsn(self.options),
+                         "host='primary,standby' port='5432,5433' "
+                         "dbname='dbname' user='user' password='pass\\'word' "
+                         "connect_timeout='3' "
+                         "target_session_attrs='prefer-standby'")
+
+    def test_override_target_session_attrs(self):
+        self.assertIn("target_session_attrs='read-write'",
+                      get_dsn(self.options, 'read-write'))
+
+    def test_load_balance_hosts(self):
+        self.options['load_balance_hosts'] = 'random'
+        self.assertIn("load_balance_hosts='random'", get_dsn(self.options))
+
+    def test_single_host_has_no_target_session_attrs(self):
+        self.options['host'] = 'primary'
+        self.assertNotIn('target_session_attrs', get_dsn(self.options))
+
 
 class TestPreprocessorDefaultTemplates(TestCase):
     def setUp(self):
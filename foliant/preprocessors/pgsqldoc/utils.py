@@ -13,3 +13,15 @@ def copy_if_not_exists(source: PosixPath,
         return
     else:
         copyfile(to_copy, source)
+
+
+def comma_separated_convertor(value) -> str:
+    '''Convert list option value into comma-separated string.'''
+    if isinstance(value, (list, tuple)):
+        return ','.join(str(v) for v in value)
+    return value
+
+
+def quote_dsn_value(value) -> str:
+    '''Escape backslashes and single quotes in libpq connection string value.'''
+    return str(value).replace('\\', '\\\\').replace("'", "\\'")
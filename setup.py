@@ -16,7 +16,7 @@ setup(
     description=SHORT_DESCRIPTION,
     long_description=LONG_DESCRIPTION,
     long_description_content_type='text/markdown',
-    version='1.1.7',
+    version='1.2.0',
     author='Daniil Minukhin',
     author_email='ddddsa@gmail.com',
     # package_dir={'': 'foliant/preprocessors/'},
@@ -32,6 +32,14 @@ setup(
         'jinja2',
         'PyYAML'
     ],
+    entry_points={
+        'console_scripts': [
+            'pgsqldoc-daemon=foliant.preprocessors.pgsqldoc.daemon:main'
+        ]
+    },
+    extras_require={
+        'asyncpg': ['asyncpg>=0.28']
+    },
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Environment :: Console",